@@ -2,9 +2,16 @@ import streamlit as st
 import pandas as pd
 import numpy as np
 import plotly.express as px
-from dateutil import parser
+import plotly.graph_objects as go
+import pyarrow as pa
+import pyarrow.csv as pcsv
 from datetime import datetime, date
-from typing import Dict, List, Tuple
+import hashlib
+import os
+from io import BytesIO
+from pathlib import Path
+import tempfile
+from typing import Dict, List, Optional, Tuple
 
 st.set_page_config(page_title="MIS Dashboard", page_icon="📊", layout="wide")
 
@@ -26,109 +33,247 @@ DEFAULT_MAPPING = {
     "customers": ["customers", "unique_customers", "active_users"],
 }
 
+COUNT_COLS = ["orders", "units", "customers"]
+
+SAMPLE_PATH = Path("assets/sample_mis.csv")
+
 if "mapping" not in st.session_state:
     st.session_state["mapping"] = DEFAULT_MAPPING.copy()
 
 if "df" not in st.session_state:
     st.session_state["df"] = None
 
+if "data_key" not in st.session_state:
+    st.session_state["data_key"] = None
+
 # -----------------------------
 # Loaders
 # -----------------------------
 
-@st.cache_data(show_spinner=False)
-def load_data(file) -> pd.DataFrame:
-    if file.name.lower().endswith(".csv"):
-        df = pd.read_csv(file)
+@st.cache_data(show_spinner=False, max_entries=4)
+def load_data(file_bytes: bytes, file_name: str) -> pd.DataFrame:
+    if file_name.lower().endswith(".csv"):
+        # Arrow's multithreaded parser is much faster than the C engine on large exports
+        try:
+            df = pd.read_csv(BytesIO(file_bytes), engine="pyarrow")
+        except (ValueError, pa.ArrowException):
+            df = None  # e.g. pandas 2.2 rejects repeated headers with the pyarrow engine
+        if df is not None and not df.columns.is_unique:
+            df = None
+        if df is not None:
+            # Arrow returns non-UTF-8 text (cp1252/Latin-1 exports) as bytes values instead of failing;
+            # its columns are homogeneous, so checking the first valid value per column is enough
+            first_vals = (df[c].loc[df[c].first_valid_index()] for c in df.columns if df[c].dtype == object and df[c].first_valid_index() is not None)
+            if any(isinstance(v, bytes) for v in first_vals):
+                df = None
+        if df is None:
+            # The C engine de-duplicates repeated headers (region, region.1, ...) and raises
+            # UnicodeDecodeError on non-UTF-8 input rather than passing bytes through
+            df = pd.read_csv(BytesIO(file_bytes))
     else:
+        # Excel parsing (openpyxl) is slow; keep a Parquet copy so repeat uploads skip it
+        cache = Path(tempfile.gettempdir()) / f"mis_{hashlib.sha1(file_bytes).hexdigest()}.parquet"
+        if cache.exists():
+            try:
+                return pd.read_parquet(cache)
+            except (pa.ArrowException, OSError):
+                # Unreadable copy (e.g. an interrupted write from an older version): drop it and re-parse
+                cache.unlink(missing_ok=True)
         # Excel: pick first sheet by default
-        df = pd.read_excel(file, sheet_name=0)
+        df = pd.read_excel(BytesIO(file_bytes), sheet_name=0)
+        # Parquet stringifies non-str headers (1 -> "1"), so a cached copy would come back renamed
+        if all(isinstance(c, str) for c in df.columns):
+            # Write under a private temp name and swap it in atomically, so readers never see a partial file
+            fd, tmp = tempfile.mkstemp(dir=cache.parent, prefix="mis_", suffix=".tmp")
+            os.close(fd)
+            try:
+                df.to_parquet(tmp, compression="zstd")
+                os.replace(tmp, cache)
+            except (pa.ArrowException, ValueError, OSError):
+                # Mixed-type object columns can't go to Parquet; skip the cache
+                Path(tmp).unlink(missing_ok=True)
     return df
 
+@st.cache_resource
+def sample_data() -> Tuple[bytes, pd.DataFrame]:
+    # Demo data is read once per server process and shared read-only across sessions/reruns
+    file_bytes = SAMPLE_PATH.read_bytes()
+    return file_bytes, pcsv.read_csv(BytesIO(file_bytes)).to_pandas()
+
+def auto_detect(cols, mapping: Dict[str, List[str]]) -> Dict[str, Optional[str]]:
+    # Build reverse lookup by lower-case once, then one dict probe per candidate
+    lower_cols = {c.lower(): c for c in cols}
+    return {
+        std_col: next((lower_cols[cand.lower()] for cand in candidates if cand.lower() in lower_cols), None)
+        for std_col, candidates in mapping.items()
+    }
+
 def normalize_columns(df: pd.DataFrame, mapping: Dict[str, List[str]]) -> Tuple[pd.DataFrame, Dict[str,str]]:
-    # Build reverse lookup by lower-case
-    lower_cols = {c.lower(): c for c in df.columns}
-    chosen = {}
-    for std_col, candidates in mapping.items():
-        found = None
-        for cand in candidates:
-            key = cand.lower()
-            if key in lower_cols:
-                found = lower_cols[key]
-                break
-        chosen[std_col] = found
-    # Rename
+    chosen = auto_detect(df.columns, mapping)
+    # Rename on a shallow copy: callers don't mutate df, so share its data instead of copying
     rename_map = {v: k for k, v in chosen.items() if v is not None}
-    ndf = df.rename(columns=rename_map).copy()
+    ndf = df.copy(deep=False)
+    ndf.columns = [rename_map.get(c, c) for c in ndf.columns]
     return ndf, chosen
 
 def coerce_types(df: pd.DataFrame) -> pd.DataFrame:
     if "date" in df.columns:
-        try:
-            df["date"] = pd.to_datetime(df["date"])
-        except Exception:
-            # Attempt generic parse
-            df["date"] = pd.to_datetime(df["date"].apply(lambda x: parser.parse(str(x), dayfirst=False)), errors="coerce")
+        dates = pd.to_datetime(df["date"], errors="coerce", cache=True)
+        if (dates.isna() & df["date"].notna()).any():
+            # Some present values didn't fit the inferred format; parse each value's format individually
+            dates = pd.to_datetime(df["date"], errors="coerce", cache=True, format="mixed", dayfirst=False)
+        df["date"] = dates
     for num_col in ["orders","units","gmv","revenue","cost","customers"]:
         if num_col in df.columns:
-            df[num_col] = pd.to_numeric(df[num_col], errors="coerce")
+            # Counts shrink to the smallest int dtype (sums still accumulate in int64);
+            # money columns stay float64 so large totals keep full precision
+            downcast = "integer" if num_col in COUNT_COLS else None
+            df[num_col] = pd.to_numeric(df[num_col], errors="coerce", downcast=downcast)
+    # Low-cardinality dimensions: int codes make groupby/isin much cheaper than object strings
+    for dim_col in ["segment","region","channel","product"]:
+        if dim_col in df.columns:
+            df[dim_col] = df[dim_col].astype("category")
     return df
 
+@st.cache_data(show_spinner=False, max_entries=4)
+def prepare_df(file_bytes: bytes, file_name: str, mapping_items: tuple) -> pd.DataFrame:
+    # Keyed on file content + mapping, so filter widgets never re-parse dates/numbers.
+    # Each entry is a full copy of the dataset, so only the last few file/mapping combos are kept
+    df = load_data(file_bytes, file_name)  # cache_data hands back a private copy, so rename in place
+    df.rename(columns=dict(mapping_items), inplace=True)
+    return coerce_types(df)
+
 def validate_data(df: pd.DataFrame) -> List[str]:
     issues = []
     if "date" not in df.columns:
         issues.append("Missing required column: date")
     if "revenue" not in df.columns and "gmv" not in df.columns:
         issues.append("Need at least one of: revenue or gmv")
-    for col in df.columns:
-        if df[col].isna().mean() > 0.5:
+    # NA fraction for every column in one vectorized reduction
+    na_frac = df.isna().mean()
+    for col, frac in na_frac.items():
+        if frac > 0.5:
             issues.append(f"Column '{col}' has >50% missing values")
     return issues
 
+@st.cache_data(show_spinner=False, max_entries=8)
+def to_csv_bytes(df: pd.DataFrame) -> bytes:
+    # Serialize only when the filtered view changes; keep just the last few views in memory.
+    # pandas' writer (not Arrow's) so dates, floats and quoting stay in the usual CSV format
+    return df.to_csv(index=False).encode("utf-8")
+
 # -----------------------------
 # Metrics & Charts
 # -----------------------------
 
-def build_kpis(df: pd.DataFrame) -> Dict[str, float]:
+SUM_COLS = ["orders", "units", "gmv", "revenue", "cost"]
+TOP_N = 20  # breakdown charts show the largest groups only; long tails are unreadable anyway
+
+@st.cache_data(show_spinner=False)
+def compute_aggregates(df: pd.DataFrame) -> Dict[str, object]:
+    # All groupbys/reductions for KPIs and charts, computed once per filtered view
+    metric = "revenue" if "revenue" in df else ("gmv" if "gmv" in df else None)
+    aggs = {"metric": metric}
+    # Single reduction over every summed column instead of one pass per KPI
+    aggs["kpi_sums"] = df[[c for c in SUM_COLS if c in df]].sum()
+    aggs["customers"] = df["customers"].nunique() if "customers" in df else np.nan
+    if "date" in df:
+        daily_cols = [c for c in (metric, "orders") if c and c in df]
+        if daily_cols:
+            # Bin to calendar days (time-of-day stamps would otherwise become one point each);
+            # floor rather than resample so weekly/monthly exports don't gain zero-filled days
+            aggs["daily"] = df.groupby(df["date"].dt.floor("D"))[daily_cols].sum().reset_index()
+    if metric:
+        for dim in ("segment", "region", "channel"):
+            if dim in df:
+                totals = df.groupby(dim, observed=True)[metric].sum()
+                top = totals.nlargest(TOP_N)
+                if dim == "segment" and len(totals) > TOP_N:
+                    # Segment feeds a pie: fold the tail into one slice so shares stay of the full total
+                    top = pd.concat([top, pd.Series({"Other": totals.sum() - top.sum()})])
+                aggs[f"by_{dim}"] = top.rename(metric).rename_axis(dim).reset_index()
+    return aggs
+
+MAX_LINE_POINTS = 2000
+MAX_BAR_POINTS = 500
+
+def lttb_indices(x: np.ndarray, y: np.ndarray, n_out: int) -> np.ndarray:
+    # Largest-Triangle-Three-Buckets: keep first/last point, then per bucket the point
+    # forming the largest triangle with the previous pick and the next bucket's mean
+    n = len(x)
+    if n_out >= n or n_out < 3:
+        return np.arange(n)
+    edges = np.linspace(1, n - 1, n_out - 1).astype(int)
+    picked = np.empty(n_out, dtype=np.int64)
+    picked[0], picked[-1] = 0, n - 1
+    a = 0
+    for i in range(n_out - 2):
+        start, end = edges[i], edges[i + 1]
+        nxt_end = edges[i + 2] if i + 2 < len(edges) else n
+        avg_x, avg_y = x[end:nxt_end].mean(), y[end:nxt_end].mean()
+        area = np.abs((x[a] - avg_x) * (y[start:end] - y[a]) - (x[a] - x[start:end]) * (avg_y - y[a]))
+        a = start + int(area.argmax())
+        picked[i + 1] = a
+    return picked
+
+def build_kpis(aggs: Dict[str, object]) -> Dict[str, float]:
+    sums, metric = aggs["kpi_sums"], aggs["metric"]
     kpis = {}
-    kpis["Revenue"] = float(df.get("revenue", pd.Series(dtype=float)).sum()) if "revenue" in df else float(df.get("gmv", pd.Series(dtype=float)).sum())
-    kpis["Orders"] = float(df.get("orders", pd.Series(dtype=float)).sum())
-    kpis["Units"] = float(df.get("units", pd.Series(dtype=float)).sum())
-    kpis["Customers"] = float(df.get("customers", pd.Series(dtype=float)).nunique()) if "customers" in df else np.nan
-    if "cost" in df and ("revenue" in df or "gmv" in df):
-        sales = df["revenue"] if "revenue" in df else df["gmv"]
-        kpis["Gross Margin"] = float((sales - df["cost"]).sum())
-        kpis["GM %"] = float(np.round(100 * (1 - (df["cost"].sum() / (sales.sum() or 1))), 2))
+    kpis["Revenue"] = float(sums[metric]) if metric else 0.0
+    kpis["Orders"] = float(sums.get("orders", 0.0))
+    kpis["Units"] = float(sums.get("units", 0.0))
+    kpis["Customers"] = float(aggs["customers"])
+    if "cost" in sums and metric:
+        # sum(sales - cost) == sum(sales) - sum(cost): reuse the column sums, no row-wise temporary
+        kpis["Gross Margin"] = float(sums[metric] - sums["cost"])
+        kpis["GM %"] = float(np.round(100 * (1 - (sums["cost"] / (sums[metric] or 1))), 2))
     return kpis
 
-def build_charts(df: pd.DataFrame):
+# Figure builders are cached on the aggregated frames, so reruns over unchanged aggregates
+# skip Plotly Express construction; st.plotly_chart still serializes the returned figure
+@st.cache_data(show_spinner=False)
+def line_fig(data: pd.DataFrame, x: str, y: str, title: str, markers: bool = False, render_mode: str = "auto") -> go.Figure:
+    if len(data) > MAX_LINE_POINTS:
+        # Bound browser render cost; LTTB keeps the visual shape of the series
+        xs = data[x].to_numpy("datetime64[ns]").astype(np.int64).astype(float)
+        data = data.iloc[lttb_indices(xs - xs[0], data[y].to_numpy(dtype=float), MAX_LINE_POINTS)]
+    return px.line(data, x=x, y=y, markers=markers, title=title, render_mode=render_mode)
+
+@st.cache_data(show_spinner=False)
+def bar_fig(data: pd.DataFrame, x: str, y: str, title: str) -> go.Figure:
+    return px.bar(data, x=x, y=y, title=title)
+
+@st.cache_data(show_spinner=False)
+def pie_fig(data: pd.DataFrame, names: str, values: str, title: str) -> go.Figure:
+    return px.pie(data, names=names, values=values, title=title)
+
+def build_charts(aggs: Dict[str, object]):
+    metric = aggs["metric"]
+    daily = aggs.get("daily")
     # Timeseries
     c1, c2 = st.columns((2,1))
     with c1:
-        if "date" in df and ("revenue" in df or "gmv" in df):
-            metric = "revenue" if "revenue" in df else "gmv"
-            ts = df.groupby("date", as_index=False)[metric].sum().sort_values("date")
-            fig = px.line(ts, x="date", y=metric, markers=True, title="Revenue over time")
+        if daily is not None and metric:
+            fig = line_fig(daily, "date", metric, "Revenue over time", markers=True)
             st.plotly_chart(fig, use_container_width=True)
     with c2:
-        if "orders" in df and "date" in df:
-            ts2 = df.groupby("date", as_index=False)["orders"].sum().sort_values("date")
-            fig2 = px.bar(ts2, x="date", y="orders", title="Orders per day")
+        if daily is not None and "orders" in daily:
+            if len(daily) > MAX_BAR_POINTS:
+                # Thousands of SVG bars stall the browser; draw a WebGL line instead
+                fig2 = line_fig(daily, "date", "orders", "Orders per day", render_mode="webgl")
+            else:
+                fig2 = bar_fig(daily, "date", "orders", "Orders per day")
             st.plotly_chart(fig2, use_container_width=True)
 
     # Breakdown charts
     b1, b2, b3 = st.columns(3)
-    metric = "revenue" if "revenue" in df else ("gmv" if "gmv" in df else None)
     if metric:
-        if "segment" in df:
-            seg = df.groupby("segment", as_index=False)[metric].sum().sort_values(metric, ascending=False)
-            b1.plotly_chart(px.pie(seg, names="segment", values=metric, title="Revenue by Segment"), use_container_width=True)
-        if "region" in df:
-            reg = df.groupby("region", as_index=False)[metric].sum().sort_values(metric, ascending=False)
-            b2.plotly_chart(px.bar(reg, x="region", y=metric, title="Revenue by Region"), use_container_width=True)
-        if "channel" in df:
-            ch = df.groupby("channel", as_index=False)[metric].sum().sort_values(metric, ascending=False)
-            b3.plotly_chart(px.bar(ch, x="channel", y=metric, title="Revenue by Channel"), use_container_width=True)
+        if "by_segment" in aggs:
+            b1.plotly_chart(pie_fig(aggs["by_segment"], "segment", metric, "Revenue by Segment"), use_container_width=True)
+        if "by_region" in aggs:
+            b2.plotly_chart(bar_fig(aggs["by_region"], "region", metric, "Revenue by Region"), use_container_width=True)
+        if "by_channel" in aggs:
+            b3.plotly_chart(bar_fig(aggs["by_channel"], "channel", metric, "Revenue by Channel"), use_container_width=True)
 
 # -----------------------------
 # Sidebar - Upload & Filters
@@ -138,32 +283,36 @@ st.sidebar.header("Upload MIS")
 file = st.sidebar.file_uploader("Upload CSV or Excel", type=["csv","xlsx","xls"])
 
 if file:
-    raw = load_data(file)
+    file_bytes, file_name, source_id = file.getvalue(), file.name, file.file_id
+    raw = load_data(file_bytes, file_name)
 else:
     st.sidebar.info("No file uploaded. Using sample data from assets/sample_mis.csv")
-    raw = pd.read_csv("assets/sample_mis.csv")
+    (file_bytes, raw), file_name, source_id = sample_data(), SAMPLE_PATH.name, str(SAMPLE_PATH)
 
 # Column mapping
 with st.expander("🔧 Column Mapping", expanded=False):
     st.caption("Map your MIS columns to standard names. Unmapped columns will be ignored for metrics.")
     mapping = {}
-    for std_col, candidates in DEFAULT_MAPPING.items():
-        options = ["-- None --"] + list(raw.columns)
-        # try auto-detect
-        preselect = "-- None --"
-        for cand in candidates:
-            for real in raw.columns:
-                if real.lower() == cand.lower():
-                    preselect = real
-                    break
-            if preselect != "-- None --":
-                break
-        mapping[std_col] = st.selectbox(f"{std_col} →", options, index=options.index(preselect) if preselect in options else 0, key=f"map_{std_col}")
+    # Options and their positions are the same for every std column; build them once
+    options = ["-- None --"] + list(raw.columns)
+    option_index = {opt: i for i, opt in enumerate(options)}
+    detected = auto_detect(raw.columns, DEFAULT_MAPPING)
+    for std_col in DEFAULT_MAPPING:
+        preselect = detected[std_col] or "-- None --"
+        mapping[std_col] = st.selectbox(f"{std_col} →", options, index=option_index.get(preselect, 0), key=f"map_{std_col}")
     # apply
     rename_map = {v: k for k, v in mapping.items() if v and v != "-- None --"}
-    df = raw.rename(columns=rename_map).copy()
-    df = coerce_types(df)
-    st.session_state["df"] = df
+    mapping_items = tuple(sorted(rename_map.items()))
+    st.session_state["df"] = prepare_df(file_bytes, file_name, mapping_items)
+    # Per-dataset values that don't depend on filters: recompute only when file or mapping
+    # changes (file_id is new for every upload, so the bytes needn't be hashed again)
+    data_key = (source_id, mapping_items)
+    if st.session_state["data_key"] != data_key:
+        st.session_state["data_key"] = data_key
+        prepared = st.session_state["df"]
+        st.session_state["date_bounds"] = (prepared["date"].min(), prepared["date"].max()) if "date" in prepared else None
+        # Filter options: category dtype keeps the (sorted) distinct values, no row scan needed
+        st.session_state["uniques"] = {c: prepared[c].cat.categories.tolist() for c in ["segment","region","channel","product"] if c in prepared}
 
 # Filters
 st.sidebar.header("Filters")
@@ -172,19 +321,27 @@ if df is None or df.empty:
     st.error("No data available after mapping.")
     st.stop()
 
+# All filters AND into one mask so the frame is sliced once, not once per filter
+mask = np.ones(len(df), dtype=bool)
+
 if "date" in df:
-    min_d, max_d = pd.to_datetime(df["date"]).min(), pd.to_datetime(df["date"]).max()
+    min_d, max_d = st.session_state["date_bounds"]
     drange = st.sidebar.date_input("Date range", value=(min_d.date(), max_d.date()))
     if isinstance(drange, tuple) and len(drange) == 2:
-        df = df[(df["date"] >= pd.to_datetime(drange[0])) & (df["date"] <= pd.to_datetime(drange[1]))]
+        mask &= ((df["date"] >= pd.to_datetime(drange[0])) & (df["date"] <= pd.to_datetime(drange[1]))).to_numpy()
 
 def multi_filter(col):
-    vals = sorted([v for v in df[col].dropna().unique()]) if col in df else []
-    picked = st.sidebar.multiselect(col.capitalize(), vals)
-    return df[df[col].isin(picked)] if picked else df
+    vals = st.session_state["uniques"].get(col, [])
+    return st.sidebar.multiselect(col.capitalize(), vals)
 
 for c in ["segment","region","channel","product"]:
-    df = multi_filter(c) if c in df else df
+    if c in df:
+        picked = multi_filter(c)
+        if picked:
+            mask &= df[c].isin(picked).to_numpy()
+
+if not mask.all():
+    df = df.loc[mask]
 
 # -----------------------------
 # Main layout
@@ -194,7 +351,8 @@ issues = validate_data(df)
 if issues:
     st.warning("Data quality notes:\n- " + "\n- ".join(issues))
 
-kpis = build_kpis(df)
+aggs = compute_aggregates(df)
+kpis = build_kpis(aggs)
 
 k1, k2, k3, k4, k5 = st.columns(5)
 k1.metric("Revenue", f"{kpis.get('Revenue', 0):,.0f}")
@@ -204,10 +362,10 @@ k4.metric("Customers", f"{kpis.get('Customers', 0):,.0f}" if not np.isnan(kpis.g
 gm_pct = kpis.get("GM %", None)
 k5.metric("GM %", f"{gm_pct:.1f}%" if gm_pct is not None else "—")
 
-build_charts(df)
+build_charts(aggs)
 
 st.subheader("Detailed Table")
 st.dataframe(df.reset_index(drop=True), use_container_width=True)
-st.download_button("⬇️ Download filtered data (CSV)", df.to_csv(index=False), file_name="filtered_mis.csv", mime="text/csv")
+st.download_button("⬇️ Download filtered data (CSV)", to_csv_bytes(df), file_name="filtered_mis.csv", mime="text/csv")
 
 st.info("Go to **Report (PPT)** in the left sidebar to export a slide deck of the current filtered view.")
\ No newline at end of file
@@ -24,19 +24,20 @@ def kpi_box(title, value):
 st.subheader("KPIs Preview")
 col = st.columns(4)
 vals = {}
+# One reduction over all KPI columns instead of a separate .sum() per metric
+sums = df[[c for c in (metric, "orders", "units", "cost") if c and c in df.columns]].sum()
 with col[0]:
-    vals["Revenue"] = float(df.get(metric, pd.Series(dtype=float)).sum()) if metric else 0.0
+    vals["Revenue"] = float(sums[metric]) if metric else 0.0
     kpi_box("Revenue", f"{vals['Revenue']:,.0f}")
 with col[1]:
-    vals["Orders"] = float(df.get("orders", pd.Series(dtype=float)).sum())
+    vals["Orders"] = float(sums.get("orders", 0.0))
     kpi_box("Orders", f"{vals['Orders']:,.0f}")
 with col[2]:
-    vals["Units"] = float(df.get("units", pd.Series(dtype=float)).sum())
+    vals["Units"] = float(sums.get("units", 0.0))
     kpi_box("Units", f"{vals['Units']:,.0f}")
 with col[3]:
-    if "cost" in df.columns and metric:
-        gm = (df[metric] - df["cost"]).sum()
-        vals["GM %"] = round(100*(1 - df["cost"].sum()/ (df[metric].sum() or 1)), 2)
+    if "cost" in sums and metric:
+        vals["GM %"] = round(100*(1 - sums["cost"]/ (sums[metric] or 1)), 2)
         kpi_box("GM %", f"{vals['GM %']}%")
     else:
         vals["GM %"] = None
@@ -45,13 +46,13 @@ with col[3]:
 # Build a couple of figures to embed
 figs = []
 if "date" in df.columns and metric:
-    ts = df.groupby("date", as_index=False)[metric].sum().sort_values("date")
+    ts = df.groupby(df["date"].dt.floor("D"))[metric].sum().reset_index()
     figs.append(px.line(ts, x="date", y=metric, markers=True, title="Revenue over time"))
 if "region" in df.columns and metric:
-    reg = df.groupby("region", as_index=False)[metric].sum().sort_values(metric, ascending=False).head(10)
+    reg = df.groupby("region", observed=True)[metric].sum().nlargest(10).reset_index()
     figs.append(px.bar(reg, x="region", y=metric, title="Top Regions by Revenue"))
 if "product" in df.columns and metric:
-    prod = df.groupby("product", as_index=False)[metric].sum().sort_values(metric, ascending=False).head(10)
+    prod = df.groupby("product", observed=True)[metric].sum().nlargest(10).reset_index()
     figs.append(px.bar(prod, x="product", y=metric, title="Top Products by Revenue"))
 
 def fig_to_image_bytes(fig):
@@ -99,21 +100,24 @@ def build_ppt(df: pd.DataFrame) -> BytesIO:
         rows, cols = min(6, len(df_top)+1), len(df_top.columns)
         table_shape = slide.shapes.add_table(rows, cols, Inches(0.5), y, Inches(9), Inches(1.5))
         table = table_shape.table
-        for j, col in enumerate(df_top.columns):
-            table.cell(0, j).text = str(col)
-        for i in range(min(5, len(df_top))):
-            for j, col in enumerate(df_top.columns):
-                table.cell(i+1, j).text = str(df_top.iloc[i, j])
+        # Materialize cell text once; per-cell df.iloc lookups are the slowest pandas access path
+        headers = [str(c) for c in df_top.columns]
+        values = df_top.head(5).astype(str).values.tolist()
+        for j, h in enumerate(headers):
+            table.cell(0, j).text = h
+        for i, row in enumerate(values, 1):
+            for j, v in enumerate(row):
+                table.cell(i, j).text = v
         return y + Inches(1.9)
 
     if "region" in df.columns and metric:
-        reg = df.groupby("region", as_index=False)[metric_col].sum().sort_values(metric_col, ascending=False).head(5)
+        reg = df.groupby("region", observed=True)[metric_col].sum().nlargest(5).reset_index()
         y = add_table("Top Regions", reg, y)
     if "product" in df.columns and metric:
-        prod = df.groupby("product", as_index=False)[metric_col].sum().sort_values(metric_col, ascending=False).head(5)
+        prod = df.groupby("product", observed=True)[metric_col].sum().nlargest(5).reset_index()
         y = add_table("Top Products", prod, y)
     if "channel" in df.columns and metric:
-        ch = df.groupby("channel", as_index=False)[metric_col].sum().sort_values(metric_col, ascending=False).head(5)
+        ch = df.groupby("channel", observed=True)[metric_col].sum().nlargest(5).reset_index()
         y = add_table("Top Channels", ch, y)
 
     bio = BytesIO()